@@ -3,15 +3,21 @@ import logging
 # Database
 import sqlite3
 import csv
+import queue
+import threading
 # Scraping
-from playwright.sync_api import sync_playwright
-import requests
+from playwright.async_api import async_playwright
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+import httpx
+import asyncio
 # Parsing
-from bs4 import BeautifulSoup as bs
-import json
+from selectolax.lexbor import LexborHTMLParser
+import orjson
 # Misc
-from typing import List
+from typing import List, Optional
+from itertools import product
 import time
+import os
 
 # Configure the logger
 
@@ -26,7 +32,22 @@ logger.addHandler(handler)
 
 # Configure the database
 
-conn = sqlite3.connect("tyres.db")
+def connect_database() -> sqlite3.Connection:
+    """
+    Opens the tyres database with pragmas tuned for bulk inserts.
+    
+    Returns: The database connection (conn)
+    """
+    conn = sqlite3.connect("tyres.db")
+    cur = conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL") # Write-ahead log so commits don't rewrite the main db file
+    cur.execute("PRAGMA synchronous=NORMAL") # Only fsync at checkpoints (safe with WAL)
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute("PRAGMA cache_size=-20000") # ~20MB page cache
+    cur.execute("PRAGMA mmap_size=268435456") # 256MB
+    return conn
+
+conn = connect_database()
 cur = conn.cursor()
 cur.execute("""
 CREATE TABLE IF NOT EXISTS tyres (
@@ -39,9 +60,82 @@ CREATE TABLE IF NOT EXISTS tyres (
     price TEXT
 )
 """)
+# Older databases were written without a unique key, so clear out their duplicate rows (keeping the first) before adding it
+# Only needed once, after that the index stops duplicates getting in
+cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_tyres_unique'")
+if cur.fetchone() is None:
+    cur.execute("""
+    DELETE FROM tyres WHERE id NOT IN (
+        SELECT MIN(id) FROM tyres GROUP BY website_name, tyre_brand, tyre_pattern, tyre_size, seasonality, price
+    )
+    """)
+    cur.execute("CREATE UNIQUE INDEX idx_tyres_unique ON tyres(website_name, tyre_brand, tyre_pattern, tyre_size, seasonality, price)")
+cur.execute("CREATE INDEX IF NOT EXISTS idx_tyres_lookup ON tyres(website_name, tyre_brand)")
 conn.commit()
 conn.close()
 
+# Database writer thread
+
+# Tyres waiting to be written, shared by every scraper so a single thread does all the writes (no fighting over the write lock)
+# Unbounded so queueing a tyre never blocks the event loop
+tyre_queue = queue.Queue()
+
+def write_batch(conn: sqlite3.Connection, rows: List[tuple], attempts: int = 5) -> None:
+    """
+    Writes a batch of tyres in one transaction, retrying if the database is busy (eg. locked by another process).
+    
+    Args: The database connection (conn), the tyre rows to insert (rows), how many times to try before giving up (attempts)
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            with conn: # Commits once per batch (or rolls back on error) instead of once per tyre
+                conn.executemany("INSERT OR IGNORE INTO tyres (website_name, tyre_brand, tyre_pattern, tyre_size, seasonality, price)"
+                                 "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            return
+        except sqlite3.OperationalError as e:
+            if attempt == attempts:
+                raise
+            logger.warning(f"Database busy writing {len(rows)} tyres, retrying (attempt {attempt} of {attempts}): {str(e)}")
+            time.sleep(attempt)
+
+def db_writer(batch_size: int = 1000, max_wait: float = 0.1) -> None:
+    """
+    Runs on its own thread, writing queued tyres to the database in batches (up to batch_size rows or max_wait seconds' worth, whichever comes first) until it gets None.
+    
+    Args: Max rows per transaction (batch_size), max seconds to wait for a batch to fill up (max_wait)
+    """
+    conn = connect_database() # sqlite connections can only be used on the thread that made them
+    finished = False
+    while not finished:
+        batch = [tyre_queue.get()]
+        deadline = time.monotonic() + max_wait
+        while len(batch) < batch_size and batch[-1] is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(tyre_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        rows = [row for row in batch if row is not None]
+        finished = len(rows) < len(batch) # Got the None sentinel
+        try:
+            write_batch(conn, rows)
+        except sqlite3.Error:
+            logger.exception(f"Failed to write {len(rows)} tyres to the database.") # Keep the thread going so the rest still get written
+    conn.close()
+
+db_writer_thread = threading.Thread(target=db_writer, daemon=True)
+db_writer_thread.start()
+
+def stop_db_writer() -> None:
+    """
+    Writes any remaining tyres and stops the database writer thread.
+    """
+    tyre_queue.put(None) # Sentinel telling the writer to finish up
+    db_writer_thread.join()
+
 # Base scraper class
 
 class TyreScraper:
@@ -50,77 +144,58 @@ class TyreScraper:
     """
     def __init__(self):
         self.website = "Unknown"
-        self.last_request_time = None
 
-    def fetch_html(self, url: str) -> bs: 
-        """
-        Fetch the HTML content of a page and parse it with beautiful soup.
-        
-        Args: The URL to fetch (url)
-            
-        Returns: Beautiful soup parsed html (soup)
+    def queue_tyre(self, brand, pattern, size, season, price):
         """
-
-        response = requests.get(url)
-        self.last_request_time = time.monotonic()
-        response.raise_for_status() # Checks status 
-        html = response.text 
-        soup = bs(html, "html.parser")
-        return soup
-        
-    def fetch_html_timed(self, url: str) -> bs:
-        """
-        Ensures requests are at least a second apart.
-        
-        Args: The URL to fetch (url)
-            
-        Returns: Beautiful soup parsed html (soup)
-            
-        Raises: A failed request error (RequestException)
-        """
-        try:
-            if self.last_request_time:
-                time_elapsed = time.monotonic() - self.last_request_time
-                if time_elapsed <= 1:
-                    time.sleep(1-time_elapsed) 
-            soup = self.fetch_html(url)
-            return soup
-        except requests.RequestException as e:
-            raise RuntimeError(f"Failed to fetch page {url}: {str(e)}")
-
-    def add_to_database(self, brand, pattern, size, season, price):
-        """
-        Adds the tyre to the database (and logs that it has done that).
+        Queues the tyre for the database writer thread (and logs that it has done that). Never blocks, so it is safe to call from coroutines.
         
         Args: The brand, pattern, size, season, and price of the tyre (brand, pattern, size, season, price).
         """
         logger.info("Adding tyre to database:\n"
                 f"Website name: {self.website}, Brand: {brand}, Pattern: {pattern}, "
-                f"Size: {size}, Season: {season}, Cost: {price}") # Adds each tyre found for each garage even if they might be a repeat of the same tyre at a diff garage
-        conn = sqlite3.connect("tyres.db") # Better to open this once per session and use a context manager rather than call it for each tyre
-        cur = conn.cursor()
-        cur.execute("INSERT INTO tyres (website_name, tyre_brand, tyre_pattern, tyre_size, seasonality, price)"
-                    "VALUES (?, ?, ?, ?, ?, ?)", 
-                    (self.website, brand, pattern, size, season.lower(), price))
-        conn.commit()
-        conn.close()
+                f"Size: {size}, Season: {season}, Cost: {price}") # Logs each tyre found for each garage, repeats of the same tyre at a diff garage are ignored by the database
+        tyre_queue.put_nowait((self.website, brand, pattern, size, season.lower(), price))
 
 # Scrape Dexel
 
 class DexelScraper(TyreScraper):
     """ Class to scrape Dexel's tyre info. """
 
+    # Selectors used for every tyre on every page, defined once
+    _SEL_TYRE = "div.tkf-product"
+    _SEL_INFO = "div.detailArea.tf-title-tooltip-box"
+    _SEL_BRAND = 'input[name="brand"]'
+    _SEL_PATTERN = 'input[name="pattern"]'
+    _SEL_SIZE = "p.para-text"
+    _SEL_SEASON = "div.tyre-icons i"
+    _SEL_PRICE = "div.box"
+
+    # Everything scrape_branch needs to know about the pagination, collected in the browser in one go
+    _PAGINATION_STATE_JS = """
+        () => {
+            const d = document.querySelector('div.custom-pagination');
+            const as = d ? [...d.querySelectorAll('a')] : [];
+            const lis = d ? [...d.querySelectorAll('li')] : [];
+            return {
+                aCount: as.length,
+                lastAText: as.at(-1)?.textContent?.trim() ?? '',
+                lastLiClass: lis.at(-1)?.getAttribute('class') ?? '',
+            };
+        }
+    """
+
+
     def __init__(self):
         super().__init__() # Nothing that isn't overwritten 
         self.website = "Dexel"
     
-    def select_dropdown(self, page, dropdown: str, selection: str):
+    async def select_dropdown(self, page, dropdown: str, selection: str):
         """ 
         Uses javascript to select the dropdowns.
 
         Args: Dropdown to select (dropdown), value to select in dropdown (selection).
         """
-        page.evaluate("""
+        await page.evaluate("""
             (args) => {
                 const select = document.querySelector(args.selector);
                 select.value = args.selection;
@@ -128,10 +203,39 @@ class DexelScraper(TyreScraper):
             }
         """, {"selector": dropdown, "selection": selection})
 
+    async def wait_for_options(self, page, dropdown: str):
+        """
+        Waits until a dropdown has been filled in (the options cascade from the previous dropdown's choice).
+
+        Args: Dropdown to wait for (dropdown).
+        """
+        await page.wait_for_function("""
+            (selector) => {
+                const select = document.querySelector(selector);
+                return select !== null && select.options.length > 1;
+            }
+        """, arg = dropdown)
+
+    async def wait_for_search_link(self, page, search_link, rim_size: str):
+        """
+        Waits until the search link has caught up with the last dropdown (enabled and, if it is a real link, pointing at the chosen rim size).
+
+        Args: Search link locator (search_link), rim size that was selected (rim_size).
+        """
+        await page.wait_for_function("""
+            ([link, rimSize]) => {
+                if (link.classList.contains('disabled') || link.getAttribute('aria-disabled') === 'true') {
+                    return false;
+                }
+                const href = link.getAttribute('href') || '';
+                const scripted = href === '' || href === '#' || href.startsWith('javascript'); // Search is done in JS, nothing to check
+                return scripted || href.includes(rimSize);
+            }
+        """, arg = [await search_link.element_handle(), rim_size])
 
-    def nav_to_branch_page(self, page, input_tuple: tuple[int, int, int]) -> tuple:
+    async def nav_to_branch_page(self, page, input_tuple: tuple[int, int, int]) -> tuple:
         """
-        Creates a new session and navigates to the branch selection page.
+        Navigates (back) to the home page and on to the branch selection page.
         
         Args: Input tuple of width, aspect ratio, and rim size for tyre search (input_tuple)
 
@@ -139,134 +243,155 @@ class DexelScraper(TyreScraper):
         """
         width, aspect_ratio, rim_size = input_tuple
 
-        page.goto("http://www.dexel.co.uk/")
+        await page.goto("http://www.dexel.co.uk/")
 
         # Get to the tyre page
-        page.get_by_role("link", name = "Search by Tyre Size.").click()
-        page.wait_for_timeout(1000)
+        await page.get_by_role("link", name = "Search by Tyre Size.").click()
+        await self.wait_for_options(page, 'select.width_list')
         # Trick it with javascript since clicking the divs/select doesn't work
-        self.select_dropdown(page, 'select.width_list', f"{width}")
-        page.wait_for_timeout(1000) 
-        self.select_dropdown(page, 'select.profile_list', f"{aspect_ratio}")
-        page.wait_for_timeout(1000) 
-        self.select_dropdown(page, 'select.size_list', f"{rim_size}")
-        page.wait_for_timeout(1000) 
-        page.get_by_role("link", name = "Search ").nth(0).click()
-        page.wait_for_timeout(1000) 
+        await self.select_dropdown(page, 'select.width_list', f"{width}")
+        await self.wait_for_options(page, 'select.profile_list') 
+        await self.select_dropdown(page, 'select.profile_list', f"{aspect_ratio}")
+        await self.wait_for_options(page, 'select.size_list') 
+        await self.select_dropdown(page, 'select.size_list', f"{rim_size}")
+        search_link = page.get_by_role("link", name = "Search ").nth(0)
+        await self.wait_for_search_link(page, search_link, f"{rim_size}")
+        await search_link.click()
+        await page.get_by_role("button", name = "Select This Branch").first.wait_for() # Wait for the branch list to show up
 
         return page
 
-    def scrape_branch(self, page, branch_number_to_select: int, inputs: tuple) -> None:
+    async def scrape_branch(self, page, branch_number_to_select: int, inputs: tuple) -> None:
         """
         Scrapes all pages for the selected branch and closes the browser.
         
         Args: Page playwright instance at branch select (page), browser playwright instance (browser), branch number to select (branch_number_to_select).
         """
         
-        page.get_by_role("button", name = "Select This Branch").nth(branch_number_to_select).click() # Selects the branch
-        page.wait_for_timeout(15000) # Wait a while for it to load
+        await page.get_by_role("button", name = "Select This Branch").nth(branch_number_to_select).click() # Selects the branch
+        try: # Wait for the results (or at least the pagination) to load
+            await page.wait_for_selector('div.tkf-product, div.custom-pagination', timeout = 20000)
+        except PlaywrightTimeoutError:
+            logger.warning(f"Timed out waiting for results for this tyre search {inputs}, scraping whatever has loaded.")
 
         pagination_div = page.locator('div.custom-pagination')
 
         while True:  # Loops through the pages
 
-            html_individual_page = page.content() # Grabs the page content
+            html_individual_page = await page.content() # Grabs the page content
             self.parse_html(html_individual_page)
 
             #logger.info("------------------------------------------------------------------------------------\nBreaking pagination, only scraped page 1")
             #break  # For testing purposes only scraping the first page, this break will be removed later
 
-            if pagination_div.locator('a').count() == 0:
+            state = await page.evaluate(self._PAGINATION_STATE_JS) # Reads the pagination in one round trip rather than one per check
+
+            if state["aCount"] == 0:
                 logger.info(f"There is only one page for this tyre search {inputs}, it may be that there are no matching tyres.")
                 break
 
-            if 'Last' in pagination_div.locator('a').last.text_content().strip(): # If the 'Last >' button exists
-                number_of_links = pagination_div.locator("a").count() # Count how many list items 
-                next_page = pagination_div.locator("a").nth(number_of_links-2) # Identify the 2nd to last link (next page)
-                next_page.click()
-            elif pagination_div.locator("li").last.get_attribute('class') == 'active': # If we're on the last page, break out of the loop
+            if 'Last' in state["lastAText"]: # If the 'Last >' button exists
+                next_page = pagination_div.locator("a").nth(state["aCount"]-2) # Identify the 2nd to last link (next page)
+                await next_page.click()
+            elif state["lastLiClass"] == 'active': # If we're on the last page, break out of the loop
                 break
             else: # We're close to the end and the last button has disapeared
-                pagination_div.locator("a").last.click() # Click the next page button (last link)
+                await pagination_div.locator("a").last.click() # Click the next page button (last link)
 
     def parse_html(self, html: str) -> None:
         """
         Parses HTML, submits each tyre to the database, and logs it.
 
         """
-        soup = bs(html, "html.parser")
+        tree = LexborHTMLParser(html)
 
-        individual_tyre_list = soup.select('div.tkf-product') # Select the divs for all the tyres
+        individual_tyre_list = tree.css(self._SEL_TYRE) # Select the divs for all the tyres
 
         for individual_tyre in individual_tyre_list: # Loop through each div (tyre)
-            info_div = individual_tyre.select_one("div.detailArea.tf-title-tooltip-box")
-            brand = info_div.select_one('input[name="brand"]').get("value").strip().capitalize()
-            pattern = info_div.select_one('input[name="pattern"]').get("value").strip().capitalize()
-            size = individual_tyre.select_one('p.para-text').get_text().strip().split()
-            size = " ".join(size[0:2]) # Join the first 2 (the size)
-            season = individual_tyre.select_one('div.tyre-icons i').get("title").strip().capitalize()
-            price_json = individual_tyre.select_one('div.box').get("data-prices") # They appear to be doing some kind of sketchy price 'personalisation'
-            parsed_price_json = json.loads(price_json)
+            info_div = individual_tyre.css_first(self._SEL_INFO)
+            brand = info_div.css_first(self._SEL_BRAND).attributes.get("value").strip().capitalize()
+            pattern = info_div.css_first(self._SEL_PATTERN).attributes.get("value").strip().capitalize()
+            size = " ".join(individual_tyre.css_first(self._SEL_SIZE).text().split(None, 2)[:2]) # Join the first 2 (the size), stops splitting after them
+            season = individual_tyre.css_first(self._SEL_SEASON).attributes.get("title").strip().capitalize()
+            price_json = individual_tyre.css_first(self._SEL_PRICE).attributes.get("data-prices") # They appear to be doing some kind of sketchy price 'personalisation'
+            parsed_price_json = orjson.loads(price_json)
             minimum_price = parsed_price_json.get("minimum_price").strip() # Pick the minimum price
 
-            self.add_to_database(brand, pattern, size, season, minimum_price)
+            self.queue_tyre(brand, pattern, size, season, minimum_price)
 
-    def scrape_all_branches(self, inputs: List[tuple[int, int, int]]) -> None:
+    async def scrape_searches(self, browser, searches: List[tuple[int, tuple[int, int, int]]], max_concurrency: int = 5) -> None:
         """
-        Scrapes the whole site for tyres. Includes a new instance of each tyre even if it is the same price etc in another garage/branch.
+        Scrapes the (branch, input) searches concurrently, each worker borrowing a warm context from a shared pool.
+
+        Args: Browser playwright instance (browser), list of (branch number, input tuple) searches (searches), max number of pages open at once (max_concurrency)
+        """
+        if not searches:
+            return
+
+        context_pool = asyncio.Queue() # Only max_concurrency contexts exist, so this also bounds how many searches run at once
+        contexts = []
+
+        async def worker(branch: int, input_tuple: tuple[int, int, int]) -> None:
+            context, page = await context_pool.get()
+            try:
+                logger.info(f"--------------------------------------------------------------------------\nScraping branch number {branch} with input {input_tuple}")
+                await context.clear_cookies() # Resets the cookies so it doesn't remember the branch, but keeps the cache
+                page = await self.nav_to_branch_page(page, input_tuple)
+                await self.scrape_branch(page, branch, input_tuple)
+            finally:
+                await context_pool.put((context, page))
+
+        try:
+            for _ in range(min(max_concurrency, len(searches))):
+                context = await browser.new_context()
+                contexts.append(context)
+                await context_pool.put((context, await context.new_page()))
+
+            results = await asyncio.gather(*[worker(branch, input_tuple) for branch, input_tuple in searches], 
+                                           return_exceptions = True) # One search failing shouldn't stop the rest
+            for (branch, input_tuple), result in zip(searches, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Failed to scrape branch number {branch} with input {input_tuple}, skipping it.", exc_info = result)
+        finally:
+            for context in contexts:
+                await context.close()
+
+    async def scrape_all_branches(self, inputs: List[tuple[int, int, int]]) -> None:
+        """
+        Scrapes the whole site for tyres. The same tyre at the same price in another garage/branch is only stored once.
 
         Args: List of size inputs in the format [[width, aspect ratio, rim size],...] (inputs)
         """
         
-        with sync_playwright() as pw:
-            browser = pw.firefox.launch(headless = False,slow_mo = 2000)
+        async with async_playwright() as pw:
+            browser = await pw.firefox.launch(headless = False,slow_mo = 2000)
 
             # Temporary context just to count branches
-            temp_context = browser.new_context()
-            temp_page = temp_context.new_page()
-            temp_page = self.nav_to_branch_page(temp_page, inputs[0])
-            branch_count = len(temp_page.get_by_role("button", name="Select This Branch").all())
-            temp_context.close()
-
-            for branch in range(branch_count):
-                logger.info(f"--------------------------------------------------------------------------\nScraping branch number {branch}")
-                for input_tuple in inputs:
-                    logger.info(f"--------------------------------------------------------------------------\nScraping new input {input_tuple}")
-                    context = browser.new_context() # Resets the cookies so it doesn't remember the branch, better to move this into branch loop and change other logic
-                    page = context.new_page() 
-                    page = self.nav_to_branch_page(page, input_tuple)
-                    self.scrape_branch(page, branch, input_tuple)
-                    context.close()
+            temp_context = await browser.new_context()
+            temp_page = await temp_context.new_page()
+            temp_page = await self.nav_to_branch_page(temp_page, inputs[0])
+            branch_count = len(await temp_page.get_by_role("button", name="Select This Branch").all())
+            await temp_context.close()
+
+            searches = list(product(range(branch_count), inputs))
+            await self.scrape_searches(browser, searches)
             logger.info(f"Scraping complete.")
-            browser.close() 
+            await browser.close() 
 
-    def scrape_one_branch(self, inputs: List[tuple[int, int, int]]) -> None:
+    async def scrape_one_branch(self, inputs: List[tuple[int, int, int]]) -> None:
         """
         Scrapes the first branch for tyres. 
 
         Args: List of size inputs in the format [[width, aspect ratio, rim size],...] (inputs)
         """
         
-        with sync_playwright() as pw:
-            browser = pw.firefox.launch(headless = False,slow_mo = 2000)
+        async with async_playwright() as pw:
+            browser = await pw.firefox.launch(headless = False,slow_mo = 2000)
 
-            # Temporary context just to count branches
-            temp_context = browser.new_context()
-            temp_page = temp_context.new_page()
-            temp_page = self.nav_to_branch_page(temp_page, inputs[0])
-            branch_count = len(temp_page.get_by_role("button", name="Select This Branch").all())
-            temp_context.close()
-
-            logger.info(f"--------------------------------------------------------------------------\nScraping branch number 0")
-            for input_tuple in inputs:
-                logger.info(f"--------------------------------------------------------------------------\nScraping new input {input_tuple}")
-                context = browser.new_context() # Resets the cookies so it doesn't remember the branch, better to move this into branch loop and change other logic
-                page = context.new_page() 
-                page = self.nav_to_branch_page(page, input_tuple)
-                self.scrape_branch(page, 0, input_tuple)
-                context.close()
+            searches = [(0, input_tuple) for input_tuple in inputs]
+            await self.scrape_searches(browser, searches)
             logger.info(f"Scraping complete.")
-            browser.close() 
+            await browser.close() 
 
 # Scrape bythjul
 
@@ -281,8 +406,97 @@ class NationalTyreExtractor(TyreScraper):
     def __init__(self):
         super().__init__()
         self.website = "National"
+
+    # Selectors used on every page, defined once. The ids are ASP.NET client ids with the naming container 
+    # prefixed (eg. ..._TyreResults_rptTyres_divTyre_0), so they have to be substring matches rather than prefix (^=) matches
+    _SEL_BRANCH_LINK = 'a[id*="hypBranchName"]'
+    _SEL_POSTCODE = 'span[itemprop="postalCode"]'
+    _SEL_TYRE = 'div[id*="TyreResults_rptTyres_divTyre_"]'
+    _SEL_PATTERN = 'a[id*="hypPattern"]'
+
+    _USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:120.0) Gecko/20100101 Firefox/120.0"
+
+    @staticmethod
+    def next_paragraph(node):
+        """
+        Finds the <p> after the paragraph the node is in, like find_parent("p").find_next_sibling("p") (selectolax has neither).
+        
+        Args: Node to start from (node)
+
+        Returns: The next paragraph node, or None if there isn't one
+        """
+        paragraph = node.parent
+        while paragraph is not None and paragraph.tag != "p": # Climbs past any wrappers (<strong>, <span> etc) to the enclosing paragraph
+            paragraph = paragraph.parent
+        if paragraph is None:
+            return None
+        sibling = paragraph.next
+        while sibling is not None and sibling.tag != "p": # Skips over text/whitespace nodes
+            sibling = sibling.next
+        return sibling
     
-    def find_branch_postcodes(self) -> List[str]:
+    async def _fetch(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, url: str) -> str:
+        """
+        Fetches a single page, waiting for a free slot first.
+        
+        Args: Shared async client (client), semaphore bounding the number of requests in flight (semaphore), the URL to fetch (url)
+
+        Returns: The raw html (html)
+        """
+        async with semaphore:
+            response = await client.get(url)
+        response.raise_for_status() # Checks status 
+        return response.text
+
+    def _client(self) -> httpx.AsyncClient:
+        """
+        Creates the async client (HTTP/2, shared keep-alive connection pool, 3 retries, 10s timeout) used for all of National's requests.
+
+        Returns: The async client (client)
+        """
+        # http2 and limits have to go on the transport, the client ignores them when given its own transport
+        transport = httpx.AsyncHTTPTransport(http2=True, limits=httpx.Limits(max_connections=20), retries=3)
+        return httpx.AsyncClient(transport=transport, timeout=10, headers={"User-Agent": self._USER_AGENT})
+
+    async def _fetch_all(self, client: httpx.AsyncClient, urls: List[str]) -> List[Optional[str]]:
+        """
+        Fetches all the pages concurrently (at most 8 at a time). A page that fails is logged and skipped rather than losing the whole batch.
+        
+        Args: Shared async client (client), the URLs to fetch (urls)
+
+        Returns: The raw html of each page (None if it failed), in the same order as the URLs (html_list)
+        """
+        semaphore = asyncio.Semaphore(8)
+        results = await asyncio.gather(*[self._fetch(client, semaphore, url) for url in urls], return_exceptions=True)
+        html_list = []
+        for url, result in zip(urls, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Failed to fetch page {url}, skipping it: {str(result)}")
+                result = None
+            html_list.append(result)
+        return html_list
+
+    def parse_html(self, html: str) -> None:
+        """
+        Parses a tyre search results page and queues each tyre for the database.
+
+        Args: The raw html of the results page (html)
+        """
+        tyre_tree = LexborHTMLParser(html)
+        individual_tyre_list = tyre_tree.css(self._SEL_TYRE)
+
+        for individual_tyre in individual_tyre_list:
+            brand = individual_tyre.attributes.get("data-brand").strip()
+            pattern = individual_tyre.css_first(self._SEL_PATTERN)
+            size = self.next_paragraph(pattern) # Size always comes after the pattern
+            pattern = pattern.text().strip()
+            size = size.text().strip() # Leaving the V bit in as it is included in the size example (eg. 205/55 R16 91V)
+            season = individual_tyre.attributes.get("data-tyre-season").strip()
+            price = individual_tyre.attributes.get("data-price").strip()
+
+            self.queue_tyre(brand, pattern, size, season, price) # Could also yield the data, or check its not in a set (remove dups) and then log it later
+
+    async def find_branch_postcodes(self) -> List[str]:
         """
         Finds the postcodes of each branch listed on the website (for use in the tyre search).
         
@@ -290,104 +504,139 @@ class NationalTyreExtractor(TyreScraper):
         """
         logger.info("Starting National postcode extraction.")
 
-        branches_page_soup = self.fetch_html("https://www.national.co.uk/branches")
-        branch_links = branches_page_soup.select('a[id*="hypBranchName"]') # Gets all a tags with 'hypBranchName' (instead of iterating through all 22 locations and all branches within them)
-        list_of_branch_sites = [f"https://www.national.co.uk/{link['href']}" for link in branch_links]
+        async with self._client() as client: # One client (and connection pool) for the whole discovery
+            response = await client.get("https://www.national.co.uk/branches")
+            response.raise_for_status() # Nothing to do without the branch list
+            branches_page_tree = LexborHTMLParser(response.text)
+            branch_links = branches_page_tree.css(self._SEL_BRANCH_LINK) # Gets all a tags with 'hypBranchName' (instead of iterating through all 22 locations and all branches within them)
+            list_of_branch_sites = [f"https://www.national.co.uk/{link.attributes['href']}" for link in branch_links]
+            list_of_branch_sites = list(dict.fromkeys(list_of_branch_sites)) # Some branches are listed more than once, only fetch each page once (keeps the order)
+
+            branch_pages = await self._fetch_all(client, list_of_branch_sites)
 
+        seen = set()
         postcodes_list = []
-        for branch_site in list_of_branch_sites:
-            individual_branch_soup = self.fetch_html(branch_site)
-            postcode = individual_branch_soup.find("span", itemprop="postalCode").text.strip()
+        for branch_page in branch_pages:
+            if branch_page is None: # Failed to fetch, already logged
+                continue
+            postcode_span = LexborHTMLParser(branch_page).css_first(self._SEL_POSTCODE)
+            if postcode_span is None:
+                logger.warning("Branch page has no postcode, skipping it.")
+                continue
+            postcode = postcode_span.text().strip()
             postcode = postcode.replace(" ", "") # Remove the space in the middle
             # logger.info(f"Postcode found: {postcode}")
-            postcodes_list.append(postcode)
+            if postcode not in seen: # Just in case there are duplicate postcodes, keeps the order so runs are reproducible
+                seen.add(postcode)
+                postcodes_list.append(postcode)
 
         logger.info(f"{len(postcodes_list)} postcodes extracted.")
 
-        return list(set(postcodes_list)) # Just in case there are duplicate postcodes
+        return postcodes_list
     
-    def extract_data_each_postcode(self, inputs: List[tuple[int, int, int]], postcodes: List[str]) -> None:
+    async def cached_branch_postcodes(self, path: str = "postcodes.json", max_age: int = 86400) -> List[str]:
         """
-        Extracts the requested data from all postcodes and adds it to the database.
+        Loads the branch postcodes from disk if they were found recently, otherwise finds them again and saves them.
         
-        Args: Input tyre size parameters (width, aspect_ratio, rim_size) in list format (inputs)
+        Args: File the postcodes are cached in (path), how old the cache can be in seconds before it is refreshed (max_age)
+
+        Returns: A list of the postcodes (postcodes)
+        """
+        if os.path.exists(path) and time.time() - os.path.getmtime(path) < max_age:
+            with open(path, "rb") as f:
+                postcodes = orjson.loads(f.read())
+            logger.info(f"{len(postcodes)} postcodes loaded from {path}.")
+            return postcodes
+
+        postcodes = await self.find_branch_postcodes()
+        if postcodes: # Don't cache an empty list (eg. if the branch markup changed), it would stop scraping for a whole day
+            with open(path, "wb") as f:
+                f.write(orjson.dumps(postcodes))
+        else:
+            logger.warning("No postcodes found, not caching them.")
+        return postcodes
+
+    async def _scrape_search(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, postcode: str, input_tuple: tuple[int, int, int]) -> None:
+        """
+        Fetches one tyre search and parses it as soon as it arrives, so pages aren't all held in memory. A page that fails to fetch or parse is logged and skipped.
+
+        Args: Shared async client (client), semaphore bounding the number of requests in flight (semaphore), postcode string (postcode), input tuple of width, aspect ratio, and rim size (input_tuple)
+        """
+        width, aspect_ratio, rim_size = input_tuple
+        url = f"https://www.national.co.uk/tyres-search/{width}-{aspect_ratio}-{rim_size}?pc={postcode}"
+        try:
+            html = await self._fetch(client, semaphore, url)
+        except httpx.HTTPError as e:
+            logger.warning(f"Failed to fetch page {url}, skipping it: {str(e)}")
+            return
+
+        logger.info(f"-------------------------------------------------------------------------------------\nScraping postcode: {postcode}, inputs: {input_tuple}")
+        try:
+            self.parse_html(html)
+        except Exception: # Eg. a tyre card missing part of its markup, don't lose the other pages over it
+            logger.exception(f"Failed to parse page {url}, skipping it.")
+
+    async def extract_data_each_postcode(self, inputs: List[tuple[int, int, int]], postcodes: List[str]) -> None:
         """
+        Extracts the requested data from all postcodes and adds it to the database.
         
-        for postcode in postcodes: 
-            logger.info(f"-------------------------------------------------------------------------------------\nScraping postcode: {postcode}")
-            for width, aspect_ratio, rim_size in inputs:
-                logger.info(f"-------------------------------------------------------------------------------------\nScraping inputs: {width, aspect_ratio, rim_size}")
-                url = f"https://www.national.co.uk/tyres-search/{width}-{aspect_ratio}-{rim_size}?pc={postcode}"
-                tyre_soup = self.fetch_html(url)
-                individual_tyre_list = tyre_soup.select('div[id*="TyreResults_rptTyres_divTyre_"]')
-
-                for individual_tyre in individual_tyre_list:
-                    brand = individual_tyre.get("data-brand").strip()
-                    pattern = individual_tyre.select_one('a[id*="hypPattern"]')
-                    size = pattern.find_parent("p").find_next_sibling("p") # Size always comes after the pattern
-                    pattern = pattern.text.strip()
-                    size = size.text.strip() # Leaving the V bit in as it is included in the size example (eg. 205/55 R16 91V)
-                    season = individual_tyre.get("data-tyre-season").strip()
-                    price = individual_tyre.get("data-price").strip()
-
-                    self.add_to_database(brand, pattern, size, season, price) # Could also yield the data and then log it later
-
-    def extract_data(self, inputs: List[tuple[int, int, int]], postcode: str) -> None:
+        Args: Input tyre size parameters (width, aspect_ratio, rim_size) in list format (inputs), list of postcode strings (postcodes)
+        """
+        semaphore = asyncio.Semaphore(8)
+        async with self._client() as client:
+            await asyncio.gather(*[self._scrape_search(client, semaphore, postcode, input_tuple) 
+                                   for postcode in postcodes for input_tuple in inputs])
+
+    async def extract_data(self, inputs: List[tuple[int, int, int]], postcode: str) -> None:
         """
         Extracts the requested data from a single postcode and adds it to the database.
         
         Args: Input tyre size parameters (width, aspect_ratio, rim_size) in list format (inputs), postcode string (postcode)
         """
-        
-        for width, aspect_ratio, rim_size in inputs:
-            logger.info(f"-------------------------------------------------------------------------------------\nScraping inputs: {width, aspect_ratio, rim_size}")
-            url = f"https://www.national.co.uk/tyres-search/{width}-{aspect_ratio}-{rim_size}?pc={postcode}"
-            tyre_soup = self.fetch_html(url)
-            individual_tyre_list = tyre_soup.select('div[id*="TyreResults_rptTyres_divTyre_"]')
-
-            for individual_tyre in individual_tyre_list:
-                brand = individual_tyre.get("data-brand").strip()
-                pattern = individual_tyre.select_one('a[id*="hypPattern"]')
-                size = pattern.find_parent("p").find_next_sibling("p") # Size always comes after the pattern
-                pattern = pattern.text.strip()
-                size = size.text.strip() # Leaving the V bit in as it is included in the size example (eg. 205/55 R16 91V)
-                season = individual_tyre.get("data-tyre-season").strip()
-                price = individual_tyre.get("data-price").strip()
-
-                self.add_to_database(brand, pattern, size, season, price) # Could also yield the data, or check its not in a set (remove dups) and then log it later
+        await self.extract_data_each_postcode(inputs, [postcode])
     
-    def scrape_all_branches(self, inputs: List) -> None:
+    async def scrape_all_branches(self, inputs: List) -> None:
         """
-        Scrapes the whole site for tyres. Includes a new instance of each tyre even if it is the same price etc in another garage/branch.
+        Scrapes the whole site for tyres. The same tyre at the same price in another garage/branch is only stored once.
 
         Args: List of size inputs in the format [[width, aspect ratio, rim size],...] (inputs)
         """
-        postcodes = self.find_branch_postcodes()
-        for postcode in postcodes: 
-            logger.info(f"-------------------------------------------------------------------------------------\nScraping postcode: {postcode}")
-            self.extract_data(inputs, postcode)
+        postcodes = await self.cached_branch_postcodes()
+        await self.extract_data_each_postcode(inputs, postcodes) # Fetches every (postcode, input) search concurrently
 
-    def scrape_one_branch(self, inputs: List) -> None:
+    async def scrape_one_branch(self, inputs: List) -> None:
         """
         Scrapes the whole site for tyres. Only includes one garage/branch.
 
         Args: List of size inputs in the format [[width, aspect ratio, rim size],...] (inputs)
         """    
-        self.extract_data(inputs, 'S118YE')
+        await self.extract_data(inputs, 'S118YE')
 
 
 inputs = [(205, 55, 16), (225, 50, 16), (185, 16, 14)]
 
-# Run dexel tyre scraping
-dexel_tyre_scraper_instance = DexelScraper()
-dexel_tyre_scraper_instance.scrape_one_branch(inputs)
-
-# Run bythjul tyre scraping
-# :( not yet
-
-# Run national tyre scraping
-national_tyre_scraper_instance = NationalTyreExtractor()
-national_tyre_scraper_instance.scrape_one_branch(inputs)
+async def main():
+    """
+    Runs the scrapers at the same time, Dexel waits on its browser while National waits on plain HTTP requests.
+    """
+    dexel_tyre_scraper_instance = DexelScraper()
+    national_tyre_scraper_instance = NationalTyreExtractor()
+    scrapers = [dexel_tyre_scraper_instance, national_tyre_scraper_instance]
+    try:
+        results = await asyncio.gather(
+            dexel_tyre_scraper_instance.scrape_one_branch(inputs), # Run dexel tyre scraping
+            # Run bythjul tyre scraping
+            # :( not yet
+            national_tyre_scraper_instance.scrape_one_branch(inputs), # Run national tyre scraping
+            return_exceptions = True, # One scraper failing shouldn't cancel the other
+        )
+        for scraper, result in zip(scrapers, results):
+            if isinstance(result, Exception):
+                logger.error(f"{scraper.website} scraping failed.", exc_info = result)
+    finally:
+        stop_db_writer()
+
+asyncio.run(main())
 
 # Convert database to csv format
 